@@ -0,0 +1,39 @@
+"""Added id to chat and creation date index in message table
+
+Revision ID: 5c8e2a9d4b17
+Revises: d41f0a8e6b27
+Create Date: 2026-10-15 14:37:05.112604
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c8e2a9d4b17"
+down_revision: Union[str, None] = "d41f0a8e6b27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index("ix_message_chat_id_creation_date", table_name="message")
+    op.create_index(
+        "ix_message_chat_id_creation_date_id",
+        "message",
+        ["chat_id", sa.text("creation_date DESC"), sa.text("id DESC")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_message_chat_id_creation_date_id", table_name="message")
+    op.create_index(
+        "ix_message_chat_id_creation_date",
+        "message",
+        ["chat_id", sa.text("creation_date DESC")],
+        unique=False,
+    )
@@ -0,0 +1,36 @@
+"""Added chat and creation date index in message table
+
+Revision ID: 9b2e6c1d7f30
+Revises: 4ae62d27244c
+Create Date: 2026-10-15 10:12:41.508233
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9b2e6c1d7f30"
+down_revision: Union[str, None] = "4ae62d27244c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index(op.f("ix_message_chat_id"), table_name="message")
+    op.create_index(
+        "ix_message_chat_id_creation_date",
+        "message",
+        ["chat_id", sa.text("creation_date DESC")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_message_chat_id_creation_date", table_name="message")
+    op.create_index(
+        op.f("ix_message_chat_id"), "message", ["chat_id"], unique=False
+    )
@@ -0,0 +1,35 @@
+"""Added server default for creation date
+
+Revision ID: d41f0a8e6b27
+Revises: 9b2e6c1d7f30
+Create Date: 2026-10-15 11:02:17.340918
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d41f0a8e6b27"
+down_revision: Union[str, None] = "9b2e6c1d7f30"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+tables = ("user", "personal", "message", "chat")
+
+
+def upgrade() -> None:
+    for table in tables:
+        op.alter_column(
+            table,
+            "creation_date",
+            server_default=sa.text("clock_timestamp()"),
+        )
+
+
+def downgrade() -> None:
+    for table in tables:
+        op.alter_column(table, "creation_date", server_default=None)
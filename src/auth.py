@@ -1,38 +1,116 @@
-from dataclasses import dataclass
+import hashlib
+import time
+from dataclasses import dataclass, field
 from datetime import UTC, datetime, timedelta
-from typing import Annotated, Any, AsyncGenerator, Optional, Union
+from typing import (
+    Annotated,
+    Any,
+    AsyncGenerator,
+    Collection,
+    Optional,
+    Union,
+)
 
 import jwt
+import orjson
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.requests import HTTPConnection
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.config import settings
-from src.crud import get_personal_model, get_user_model
+from src.crud import (
+    get_user_cached,
+    get_user_with_personal_model,
+    rehash_user_password,
+)
 from src.dependencies import get_async_session
 from src.enums import UserRole
-from src.models import User
+from src.models import Personal, User
 from src.schemas import CreateJwt, Credentials
-from src.utils import verify_password
+from src.utils import (
+    generate_random_credential,
+    password_hasher,
+    password_needs_rehash,
+    verify_password,
+)
 
 access_token_expires = timedelta(minutes=30)
 
 refresh_token_expires = timedelta(minutes=180)
 
+_secret_key = settings.SECRET_KEY.encode()
+
+_algorithms = (settings.ALGORITHMS,)
+
+authenticated_roles = frozenset({UserRole.user, UserRole.administrator})
+
+# verified against when the username is unknown, so that a missing user
+# costs the same hashing time as a wrong password
+_dummy_password_hash = password_hasher.hash(generate_random_credential(32))
+
+
+class _OrjsonJWT(jwt.PyJWT):
+    def _decode_payload(self, decoded: dict[str, Any]) -> Any:
+        try:
+            payload = orjson.loads(decoded["payload"])
+        except orjson.JSONDecodeError as e:
+            raise jwt.DecodeError(f"Invalid payload string: {e}") from e
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError(
+                "Invalid payload string: must be a json object"
+            )
+        return payload
+
+
+_jwt = _OrjsonJWT()
+
+# verified claims by token digest; the short ttl bounds how long a token
+# stays accepted without its signature being checked again
+_jwt_cache: TTLCache[tuple[bytes, bytes], dict[str, str]] = TTLCache(  # pyright: ignore[reportAssignmentType]
+    maxsize=10_000, ttl=5
+)
+
 
 @dataclass(slots=True, frozen=True)
 class Token:
     token: str
-    role: Union[UserRole, list[UserRole]]
-    key: str = settings.SECRET_KEY
-    algorithms: str = settings.ALGORITHMS
+    role: Union[UserRole, Collection[UserRole]]
+    key: bytes = _secret_key
+    algorithms: tuple[str, ...] = _algorithms
+    _payload: Optional[dict[str, str]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _role_values: frozenset[str] = field(
+        default=frozenset(), init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        if isinstance(self.role, UserRole):
+            role_values = frozenset({self.role.value})
+        else:
+            role_values = frozenset(i.value for i in self.role)
+        object.__setattr__(self, "_role_values", role_values)
 
     def _decode(self) -> dict[str, str]:
+        if self._payload is not None:
+            return self._payload
+        cache_key = (hashlib.sha256(self.token.encode()).digest(), self.key)
+        cached = _jwt_cache.get(cache_key)
+        if cached is not None and int(cached.get("exp", 0)) > time.time():
+            object.__setattr__(self, "_payload", cached)
+            return cached
         try:
-            token = jwt.decode(
-                self.token, key=self.key, algorithms=[self.algorithms]
+            token = _jwt.decode(
+                self.token,
+                key=self.key,
+                algorithms=self.algorithms,  # pyright: ignore[reportArgumentType]
             )
-            return dict(token)
+            payload = dict(token)
+            _jwt_cache[cache_key] = payload
+            # frozen dataclass: cache the verified claims on first decode
+            object.__setattr__(self, "_payload", payload)
+            return payload
         except jwt.PyJWTError as exp_err:
             raise HTTPException(
                 detail=exp_err.args,
@@ -40,20 +118,10 @@ class Token:
             ) from exp_err
 
     def _has_access(self) -> bool:
-        if isinstance(self.role, list):
-            return self._decode().get("role", None) in [
-                i.value for i in self.role
-            ]
-        else:
-            return self._decode().get("role", None) == self.role.value
+        return self._decode().get("role", None) in self._role_values
 
     def _not_access(self) -> bool:
-        if isinstance(self.role, list):
-            return self._decode().get("role", None) not in [
-                i.value for i in self.role
-            ]
-        else:
-            return self._decode().get("role", None) != self.role.value
+        return self._decode().get("role", None) not in self._role_values
 
     def check_permission(
         self,
@@ -97,6 +165,9 @@ class Token:
             detail="Token must have key email",
         )
 
+    def user_email_or_none(self) -> Optional[str]:
+        return self._decode().get("email", None)
+
 
 def _get_token_from_request(request: HTTPConnection) -> str:
     if not request.headers.get("Authorization", None):
@@ -118,20 +189,14 @@ def _get_token_from_request(request: HTTPConnection) -> str:
     )
 
 
-def create_token(
+def _token_claims(
     user: Optional[CreateJwt | None] = None,
-    expires_delta: timedelta | None = None,
     user_id: Optional[str | None] = None,
     user_role: Optional[UserRole | None] = None,
     user_email: Optional[str | None] = None,
     is_superuser: Optional[bool] = False,
-) -> str:
-    if expires_delta:
-        expire = datetime.now(UTC) + expires_delta
-    else:
-        expire = datetime.now(UTC) + timedelta(minutes=15)
-    data = {}
-    data["exp"] = expire
+) -> dict[str, Any]:
+    data: dict[str, Any] = {}
 
     if isinstance(user, CreateJwt):
         data["is_superuser"] = user.is_superuser
@@ -146,18 +211,49 @@ def create_token(
         data["email"] = user_email
     else:
         raise ValueError("Unexpected value, use Userschema or explicit values")
-    return jwt.encode(data, settings.SECRET_KEY, algorithm=settings.ALGORITHMS)
+    return data
+
+
+def create_token_pair(
+    user: Optional[CreateJwt | None] = None,
+    user_id: Optional[str | None] = None,
+    user_role: Optional[UserRole | None] = None,
+    user_email: Optional[str | None] = None,
+    is_superuser: Optional[bool] = False,
+) -> dict[str, str]:
+    data = _token_claims(user, user_id, user_role, user_email, is_superuser)
+    now = datetime.now(UTC)
+    data["exp"] = now + access_token_expires
+    access_token = jwt.encode(data, _secret_key, algorithm=settings.ALGORITHMS)
+    data["exp"] = now + refresh_token_expires
+    refresh_token = jwt.encode(
+        data, _secret_key, algorithm=settings.ALGORITHMS
+    )
+    return {
+        "access": access_token,
+        "refresh": refresh_token,
+    }
 
 
 async def check_credentials(
-    db: AsyncSession, credentials: Credentials
-) -> User:
-    user = await get_user_model(db, credentials.username)
-    if verify_password(credentials.password, user.password):
-        return user
+    db: AsyncSession, credentials: Credentials, *, for_update: bool = False
+) -> tuple[User, Personal]:
+    # for_update keeps the user row locked until the caller commits; the
+    # caller is about to replace the password, so skip the rehash
+    found = await get_user_with_personal_model(
+        db, credentials.username, for_update=for_update
+    )
+    if found is None:
+        await verify_password(credentials.password, _dummy_password_hash)
+    else:
+        user, personal = found
+        if await verify_password(credentials.password, user.password):
+            if not for_update and password_needs_rehash(user.password):
+                await rehash_user_password(db, user.id, credentials.password)
+            return user, personal
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Wrong password",
+        detail="Wrong username or password",
     )
 
 
@@ -165,28 +261,21 @@ async def check_authenticate(
     db: AsyncSession,
     credentials: Credentials,
 ):
-    user = await check_credentials(db, credentials)
-    email = await get_personal_model(db, user.id)
+    user, personal = await check_credentials(db, credentials)
 
     payload = CreateJwt(
         id=str(user.id),
         role=str(user.role.value),  # pyright: ignore[reportAttributeAccessIssue]
         is_superuser=user.is_superuser,
-        email=email["email"],
+        email=personal.email,
     )
-    access_token = create_token(payload, expires_delta=access_token_expires)
-
-    refresh_token = create_token(payload, expires_delta=refresh_token_expires)
-    return {
-        "access": access_token,
-        "refresh": refresh_token,
-    }
+    return create_token_pair(payload)
 
 
 @dataclass(frozen=True, slots=True)
 class RefreshToken(Token):
     token: str
-    role: UserRole | list[UserRole]
+    role: UserRole | Collection[UserRole]
 
     def create_token(self):
         payload = self._decode()
@@ -198,30 +287,36 @@ class RefreshToken(Token):
             user_id = payload["id"]
             role = payload["role"]
             is_superuser = bool(payload["is_superuser"])
-            access_token = create_token(
-                user_id=user_id,
-                user_role=UserRole[role],
-                is_superuser=is_superuser,
-                expires_delta=access_token_expires,
-            )
-            refresh_token = create_token(
+            return create_token_pair(
                 user_id=user_id,
                 user_role=UserRole[role],
                 is_superuser=is_superuser,
-                expires_delta=refresh_token_expires,
             )
-            return {
-                "access": access_token,
-                "refresh": refresh_token,
-            }
         else:
             raise ValueError("Unexpected decryption result")
 
 
+@dataclass(slots=True, frozen=True)
+class AuthUser:
+    id: int
+    role: str
+    email: Optional[str]
+
+
+async def get_authenticated_user(request: HTTPConnection) -> AuthUser:
+    token = Token(_get_token_from_request(request), authenticated_roles)
+    token.check_permission(exclude=False)
+    return AuthUser(
+        id=token.user_id(),
+        role=token.user_role(),
+        email=token.user_email_or_none(),
+    )
+
+
 async def get_user_from_request(
     request: HTTPConnection,
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ) -> AsyncGenerator[User, Any]:
     token = _get_token_from_request(request)
-    user_id = Token(token, [UserRole.user, UserRole.administrator]).user_id()
-    yield await get_user_model(db, user_id)
+    user_id = Token(token, authenticated_roles).user_id()
+    yield await get_user_cached(db, user_id)
@@ -1,3 +1,5 @@
+from functools import cached_property
+
 from dotenv import load_dotenv
 from fastapi_mail import ConnectionConfig
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -16,9 +18,18 @@ class Settings(BaseSettings):
     PG_NAME: str
     PG_USER: str
     PG_PASS: str
+    DB_ECHO: bool = False
+    # log one in every N statements; 0 disables sampling
+    DB_LOG_SAMPLE_RATE: int = 0
+    PG_STATEMENT_CACHE_SIZE: int = 1024
+    PG_POOL_SIZE: int = 20
+    PG_MAX_OVERFLOW: int = 30
+    # no pooling at all, e.g. for tests that run each case on its own loop
+    PG_NULL_POOL: bool = False
 
     REDIS_HOST: str
     REDIS_PORT: str
+    CACHE_ENABLED: bool = False
 
     MONGO_HOST: str
     MONGO_PORT: str
@@ -32,7 +43,7 @@ class Settings(BaseSettings):
 
     model_config = SettingsConfigDict(env_file=".env")
 
-    @property
+    @cached_property
     def db_url_postgresql(self) -> str:
         prefix = "postgresql+asyncpg://"
         return (
@@ -40,12 +51,12 @@ class Settings(BaseSettings):
             f"@{self.PG_HOST}:{self.PG_PORT}/{self.PG_NAME}"
         )
 
-    @property
+    @cached_property
     def db_url_redis(self) -> str:
         prefix = "redis://"
         return f"{prefix}{self.REDIS_HOST}:{self.REDIS_PORT}/"
 
-    @property
+    @cached_property
     def config_for_fastapi_mail(self) -> ConnectionConfig:  # pragma: no cover
         return ConnectionConfig(
             MAIL_USERNAME=self.MAIL_USERNAME,
@@ -58,7 +69,7 @@ class Settings(BaseSettings):
             MAIL_SSL_TLS=False,
         )
 
-    @property
+    @cached_property
     def db_url_mongo(self) -> str:
         prefix = "mongodb://"
         return f"{prefix}{self.MONGO_HOST}:{self.MONGO_PORT}"
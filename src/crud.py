@@ -1,304 +1,477 @@
-from typing import Sequence
+from contextlib import suppress
+from datetime import datetime
+from enum import Enum
+from functools import cache
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Sequence,
+    TypeVar,
+)
 
-from sqlalchemy import delete, select, update
-from sqlalchemy.exc import (
-    IntegrityError,
-    NoResultFound,
-    SQLAlchemyError,
+import orjson
+from redis.exceptions import RedisError
+from sqlalchemy import (
+    bindparam,
+    delete,
+    func,
+    insert,
+    select,
+    tuple_,
+    update,
 )
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.exception import SchemaError
+from src.config import settings
 from src.models import Chat, Message, Personal, User
 from src.schemas import (
     AddContact,
     ChangePassword,
     CreateMessage,
-    Credentials,
     DeleteMessage,
     Register,
     UpdateMessage,
     UpdateProfile,
-    UserSchema,
 )
+from src.storage import Base, redis_client
 from src.utils import (
+    db_guard,
     get_password_hash,
     handle_error,
 )
 
+cache_ttl = 60
+
+_uncached_columns = frozenset({"password"})
+
+_Row = TypeVar("_Row", bound=Base)
 
-async def create_user_model(db: AsyncSession, body: Register):
-    password = get_password_hash(body.password)
-    stmt = User(
-        username=body.username,
-        password=str(password),
-        role=body.role,
+_no_row_found = "No row was found when one was required"
+
+# set explicitly rather than left to the column's onupdate: only columns
+# named in values() are copied from RETURNING onto an instance that is
+# already in the identity map, so an onupdate-only value would stay stale
+_now = func.clock_timestamp()
+
+# built once at import; only the bound values change per call
+_select_user_by_username = select(User).where(
+    User.username == bindparam("username")
+)
+_select_user_with_personal = (
+    select(User, Personal)
+    .join(Personal, Personal.id == User.id)
+    .where(User.username == bindparam("username"))
+)
+# locks the user row until the caller commits, e.g. across a password check
+# and the update that follows it
+_select_user_with_personal_for_update = (
+    _select_user_with_personal.with_for_update(of=User)
+)
+_select_user_with_personal_by_id = (
+    select(User, Personal)
+    .join(Personal, Personal.id == User.id)
+    .where(User.id == bindparam("id"))
+)
+_select_messages_by_chat = (
+    select(Message)
+    .where(Message.chat_id == bindparam("chat_id"))
+    .order_by(Message.creation_date.desc(), Message.id.desc())
+    .limit(bindparam("limit"))
+)
+# keyset cursor: creation_date alone skips or repeats messages that share
+# a timestamp across a page boundary
+_select_messages_by_chat_before = _select_messages_by_chat.where(
+    tuple_(Message.creation_date, Message.id)
+    < tuple_(
+        bindparam("before", type_=Message.creation_date.type),
+        bindparam("before_id", type_=Message.id.type),
     )
-    db.add(stmt)
-    try:
-        await db.flush()
-    except (SQLAlchemyError, IntegrityError) as e:
-        await db.rollback()
-        handle_error(e)
-    return stmt.__dict__
+)
+_stream_messages_by_chat = (
+    select(Message)
+    .where(Message.chat_id == bindparam("chat_id"))
+    .order_by(Message.creation_date.desc(), Message.id.desc())
+    .execution_options(yield_per=1000)
+)
+_select_chat_by_id = select(Chat).where(Chat.id == bindparam("id"))
+_select_chats_by_user = select(Chat).where(Chat.user == bindparam("user_id"))
+_select_chat_by_user = select(Chat).where(
+    Chat.user == bindparam("user_id"), Chat.contact == bindparam("contact_id")
+)
+
+
+async def create_user_model(db: AsyncSession, body: Register) -> User:
+    password = await get_password_hash(body.password)
+    stmt = (
+        insert(User)
+        .values(
+            username=body.username,
+            password=password,
+            role=body.role,
+        )
+        .returning(User)
+    )
+    async with db_guard(db):
+        response = await db.execute(stmt)
+        return response.scalar_one()
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> User:
+    async with db_guard(db, rollback=False):
+        user = await db.get(User, user_id)
+    if user is None:
+        handle_error(NoResultFound(_no_row_found))
+    return user
+
+
+async def get_user_by_username(db: AsyncSession, username: str) -> User:
+    async with db_guard(db, rollback=False):
+        found = await db.execute(
+            _select_user_by_username, {"username": username}
+        )
+        return found.scalar_one()
 
 
 async def get_user_model(db: AsyncSession, user_param: int | str) -> User:
+    # compatibility shim, prefer get_user_by_id or get_user_by_username
     if isinstance(user_param, int):
-        query = select(User).where(User.id == user_param)
-    elif isinstance(user_param, str):
-        query = select(User).where(User.username == user_param)
+        return await get_user_by_id(db, user_param)
+    return await get_user_by_username(db, user_param)
+
+
+async def get_user_with_personal_model(
+    db: AsyncSession, username: str, *, for_update: bool = False
+) -> tuple[User, Personal] | None:
+    query = (
+        _select_user_with_personal_for_update
+        if for_update
+        else _select_user_with_personal
+    )
+    async with db_guard(db, rollback=False):
+        found = await db.execute(query, {"username": username})
+        row = found.one_or_none()
+    if row is None:
+        return None
+    user, personal = row
+    return user, personal
+
+
+def _cache_key(model: type[Base], row_id: int) -> str:
+    return f"{model.__tablename__}:{row_id}"
+
+
+def _dump_row(row: Base) -> bytes:
+    # the password hash is never needed by cache readers
+    return orjson.dumps(row.to_dict(exclude=_uncached_columns))
+
+
+@cache
+def _column_loaders(model: type[Base]) -> dict[str, Callable[[Any], Any]]:
+    loaders: dict[str, Callable[[Any], Any]] = {}
+    for column in model.__table__.c:
+        python_type = column.type.python_type
+        if python_type is datetime:
+            loaders[column.key] = datetime.fromisoformat
+        elif issubclass(python_type, Enum):
+            loaders[column.key] = python_type
+    return loaders
+
+
+def _load_row(model: type[_Row], cached: str) -> _Row:
+    data = orjson.loads(cached)
+    for key, load in _column_loaders(model).items():
+        if data.get(key) is not None:
+            data[key] = load(data[key])
+    return model(**data)
+
+
+async def _get_cached(
+    db: AsyncSession,
+    model: type[_Row],
+    row_id: int,
+    fetch: Callable[[AsyncSession, int], Awaitable[_Row]],
+) -> _Row:
+    if not settings.CACHE_ENABLED:
+        return await fetch(db, row_id)
+    key = _cache_key(model, row_id)
     try:
-        found = await db.execute(query)
-        user = found.scalar_one()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        handle_error(e)
-    return user
+        cached = await redis_client.get(key)
+    except RedisError:
+        cached = None
+    if cached is not None:
+        return _load_row(model, cached)
+    row = await fetch(db, row_id)
+    await _set_cached(row_id, row)
+    return row
+
+
+async def _set_cached(row_id: int, row: Base) -> None:
+    with suppress(RedisError):
+        await redis_client.set(
+            _cache_key(type(row), row_id), _dump_row(row), ex=cache_ttl
+        )
+
+
+async def get_user_cached(db: AsyncSession, user_id: int) -> User:
+    return await _get_cached(db, User, user_id, get_user_by_id)
+
+
+async def get_user_with_personal_by_id(
+    db: AsyncSession, user_id: int
+) -> tuple[User, Personal]:
+    if settings.CACHE_ENABLED:
+        try:
+            cached_user, cached_personal = await redis_client.mget(
+                _cache_key(User, user_id), _cache_key(Personal, user_id)
+            )
+        except RedisError:
+            cached_user = cached_personal = None
+        if cached_user is not None and cached_personal is not None:
+            return (
+                _load_row(User, cached_user),
+                _load_row(Personal, cached_personal),
+            )
+    async with db_guard(db, rollback=False):
+        response = await db.execute(
+            _select_user_with_personal_by_id, {"id": user_id}
+        )
+        user, personal = response.one()
+    if settings.CACHE_ENABLED:
+        await _set_cached(user_id, user)
+        await _set_cached(user_id, personal)
+    return user, personal
+
+
+async def invalidate_cached(model: type[Base], row_id: int) -> None:
+    if not settings.CACHE_ENABLED:
+        return
+    with suppress(RedisError):
+        await redis_client.delete(_cache_key(model, row_id))
 
 
 async def create_personal_model(
     db: AsyncSession, body: Register, user_id: int
-):
-    stmt = Personal(
-        phone=body.phone,
-        email=body.email,
-        id=user_id,
+) -> Personal:
+    stmt = (
+        insert(Personal)
+        .values(
+            phone=body.phone,
+            email=body.email,
+            id=user_id,
+        )
+        .returning(Personal)
     )
-    db.add(stmt)
-    try:
-        await db.flush()
-    except (SQLAlchemyError, IntegrityError) as e:
-        await db.rollback()
-        handle_error(e)
-    return stmt.__dict__
+    async with db_guard(db):
+        response = await db.execute(stmt)
+        return response.scalar_one()
 
 
 async def update_user_model(
-    db: AsyncSession,
-    payload: UserSchema | ChangePassword,
-    user_id: int | None = None,
-):
-    if isinstance(payload, Credentials) and user_id:
-        query = (
-            update(User)
-            .values(password=payload.new_password)
-            .where(User.id == user_id)
-        ).returning(User)
-    elif isinstance(payload, UserSchema):
-        query = (
-            update(User)
-            .values(payload.model_dump())
-            .where(User.id == payload.id)
-        ).returning(User)
-    else:
-        raise SchemaError(
-            f"Unexpected schema type, use UserSchema or Credentials, instead {payload.__class__.__name__}"
-        )
-    try:
+    db: AsyncSession, payload: ChangePassword, user_id: int
+) -> User:
+    password = await get_password_hash(payload.new_password)
+    query = (
+        update(User)
+        .values(password=password, modified_date=_now)
+        .where(User.id == user_id)
+    ).returning(User)
+    async with db_guard(db):
         response = await db.execute(query)
         user = response.scalar_one()
         await db.commit()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return user.__dict__
-
-
-async def get_personal_model(db: AsyncSession, user_id: int):
-    query = select(Personal).where(Personal.id == user_id)
-    try:
-        found = await db.execute(query)
-        user = found.scalar_one()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return user.__dict__
+    await invalidate_cached(User, user.id)
+    return user
+
+
+async def rehash_user_password(
+    db: AsyncSession, user_id: int, password: str
+) -> None:
+    # a rehash is not a change made by the user, so modified_date is
+    # written back as is instead of letting onupdate bump it
+    query = (
+        update(User)
+        .values(
+            password=await get_password_hash(password),
+            modified_date=User.modified_date,
+        )
+        .where(User.id == user_id)
+    )
+    async with db_guard(db):
+        await db.execute(query)
+        await db.commit()
+    await invalidate_cached(User, user_id)
+
+
+async def get_personal_model(db: AsyncSession, user_id: int) -> Personal:
+    async with db_guard(db, rollback=False):
+        user = await db.get(Personal, user_id)
+    if user is None:
+        handle_error(NoResultFound(_no_row_found))
+    return user
 
 
 async def update_profile_model(
     db: AsyncSession,
     payload: UpdateProfile,
     user_id: int,
-):
-    values = {}
-    if payload.email and payload.phone:
-        values = payload.model_dump()
-    elif payload.email is None:
-        values["phone"] = payload.phone
-    elif payload.phone is None:
-        values["email"] = payload.email
+) -> Personal:
     query = (
-        update(Personal).values(values).where(Personal.id == user_id)
+        update(Personal)
+        .values(payload.model_dump(exclude_none=True))
+        .values(modified_date=_now)
+        .where(Personal.id == user_id)
     ).returning(Personal)
-    try:
+    async with db_guard(db):
         response = await db.execute(query)
+        personal = response.scalar_one()
         await db.commit()
-        profile = response.scalar_one()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return profile.__dict__
+    await invalidate_cached(Personal, user_id)
+    return personal
 
 
 async def create_message_model(
     db: AsyncSession, body: CreateMessage
 ) -> Message:
-    stmt = Message(
-        text=body.text or None,
-        photo=body.photo or None,
-        sender=body.sender_id,
-        receiver=body.receiver_id,
+    chat = await get_chat_by_user(db, body.sender_id, body.receiver_id)
+    stmt = (
+        insert(Message)
+        .values(
+            text=body.text or None,
+            photo=body.photo or None,
+            sender=body.sender_id,
+            receiver=body.receiver_id,
+            chat_id=chat.id,
+        )
+        .returning(Message)
     )
-    db.add(stmt)
-    try:
-        await db.flush()
-    except (SQLAlchemyError, IntegrityError) as e:
-        await db.rollback()
-        handle_error(e)
-    return stmt
+    async with db_guard(db):
+        response = await db.execute(stmt)
+        return response.scalar_one()
+
+
+async def create_messages_model(
+    db: AsyncSession, chat_id: int, bodies: Sequence[CreateMessage]
+) -> Sequence[Message]:
+    if not bodies:
+        return []
+    values = [
+        {
+            "text": body.text or None,
+            "photo": body.photo or None,
+            "sender": body.sender_id,
+            "receiver": body.receiver_id,
+            "chat_id": chat_id,
+        }
+        for body in bodies
+    ]
+    async with db_guard(db):
+        response = await db.execute(
+            insert(Message).returning(Message, sort_by_parameter_order=True),
+            values,
+        )
+        return response.scalars().all()
 
 
 async def get_messages_model(
     db: AsyncSession,
     chat_id: int,
+    limit: int = 50,
+    before: datetime | None = None,
+    before_id: int | None = None,
 ) -> Sequence[Message]:
-    query = (
-        select(Message)
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.creation_date.desc())
-    )
-    try:
-        found = await db.execute(query)
-        messages = found.scalars().fetchall()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        handle_error(e)
-    return messages
+    query = _select_messages_by_chat
+    params: dict[str, Any] = {"chat_id": chat_id, "limit": limit}
+    if before is not None:
+        # without an id, resume after every message at that timestamp
+        query = _select_messages_by_chat_before
+        params["before"] = before
+        params["before_id"] = 0 if before_id is None else before_id
+    async with db_guard(db, rollback=False):
+        found = await db.execute(query, params)
+        return found.scalars().fetchall()
+
+
+async def iter_messages_model(
+    db: AsyncSession, chat_id: int
+) -> AsyncIterator[Message]:
+    # full history through a server-side cursor, for exports and other
+    # consumers that must not buffer a whole chat in memory
+    async with db_guard(db, rollback=False):
+        result = await db.stream_scalars(
+            _stream_messages_by_chat, {"chat_id": chat_id}
+        )
+        try:
+            async for message in result:
+                yield message
+        finally:
+            # release the server-side cursor when the consumer stops early
+            await result.close()
 
 
 async def delete_message_model(
     db: AsyncSession, message_id: DeleteMessage
 ) -> None:
     query = delete(Message).where(Message.id == message_id.id)
-    try:
+    async with db_guard(db, rollback=False):
         await db.execute(query)
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        handle_error(e)
 
 
-async def update_message_model(db: AsyncSession, new_message: UpdateMessage):
+async def update_message_model(
+    db: AsyncSession, new_message: UpdateMessage
+) -> int:
     query = (
         update(Message)
         .where(Message.id == new_message.id)
         .values(text=new_message.text)
-    )
-    try:
+    ).returning(Message.id)
+    async with db_guard(db):
         response = await db.execute(query)
+        message_id = response.scalar_one()
         await db.commit()
-        message = response.scalar_one()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return message
-
-
-async def create_contact(db: AsyncSession, payload: AddContact):
-    stmt = Chat(user=payload.id, contact=payload.to_add)
-    db.add(stmt)
-    try:
-        await db.flush()
-    except (SQLAlchemyError, IntegrityError) as e:
-        await db.rollback()
-        handle_error(e)
-    return stmt
+    return message_id
+
+
+async def create_contact(db: AsyncSession, payload: AddContact) -> Chat:
+    stmt = (
+        insert(Chat)
+        .values(user=payload.id, contact=payload.to_add)
+        .returning(Chat)
+    )
+    async with db_guard(db):
+        response = await db.execute(stmt)
+        return response.scalar_one()
 
 
 async def get_chat_by_id(db: AsyncSession, id_key: int) -> Chat:
-    query = select(Chat).where(Chat.id == id_key)
-    try:
-        response = await db.execute(query)
-        contact = response.scalar_one()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return contact
+    async with db_guard(db, rollback=False):
+        response = await db.execute(_select_chat_by_id, {"id": id_key})
+        return response.scalar_one()
 
 
 async def get_chat_by_user(
     db: AsyncSession, user_id: int, contact_id: int
 ) -> Chat:
-    query = select(Chat).where(
-        Chat.user == user_id, Chat.contact == contact_id
-    )
-    try:
-        response = await db.execute(query)
-        contact = response.scalar_one()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return contact
+    async with db_guard(db, rollback=False):
+        response = await db.execute(
+            _select_chat_by_user,
+            {"user_id": user_id, "contact_id": contact_id},
+        )
+        return response.scalar_one()
 
 
 async def get_chats_by_user(db: AsyncSession, user_id: int) -> Sequence[Chat]:
-    query = select(Chat).where(Chat.user == user_id)
-    try:
-        response = await db.execute(query)
-        await db.commit()
-        contacts = response.scalars().fetchall()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
-    return contacts
+    async with db_guard(db, rollback=False):
+        response = await db.execute(
+            _select_chats_by_user, {"user_id": user_id}
+        )
+        return response.scalars().fetchall()
 
 
 async def delete_chat(db: AsyncSession, chat_id: int) -> None:
     query = delete(Chat).where(Chat.id == chat_id)
-    try:
+    async with db_guard(db):
         await db.execute(query)
         await db.commit()
-    except (
-        NoResultFound,
-        SQLAlchemyError,
-        IntegrityError,
-    ) as e:
-        await db.rollback()
-        handle_error(e)
@@ -1,9 +1,27 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import APIRouter, FastAPI
+from fastapi.responses import ORJSONResponse
 
 from src.router import router as router_user
 from src.router_ws import router as ws_router
+from src.storage import client_mongo, engine, redis_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    await engine.dispose()
+    await redis_client.aclose()
+    client_mongo.close()
+
 
-app = FastAPI(title="oauth2")
+app = FastAPI(
+    title="oauth2",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 main_router = APIRouter(prefix="/oauth2/api/v1")
 
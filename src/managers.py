@@ -1,47 +1,67 @@
-from typing import Any
+import asyncio
+from typing import Any, Callable, Iterable
 
 from fastapi import WebSocket
 
 from src.schemas import CreateMessage, UpdateMessage
 
+_payload_extractors: dict[type, Callable[[Any], str]] = {
+    CreateMessage: lambda message: message.text or message.photo or "",
+    UpdateMessage: lambda message: message.text,
+}
 
-class Singleton:  # pragma: no cover
-    def __new__(cls, *args: Any, **kwds: Any):
-        it = cls.__dict__.get("__it__")
-        if it is not None:
-            return it
-        cls.__it__ = it = object.__new__(cls)
-        it.init(*args, **kwds)
-        return it
 
-    def init(self, *args: Any, **kwds: Any):
-        pass
-
-
-class WsConnectionManager(Singleton):
+class WsConnectionManager:
     def __init__(self):
-        self.active_connections: dict[str, tuple[WebSocket]] = {}
+        self.active_connections: dict[str, list[WebSocket]] = {}
+        self._by_socket: dict[int, str] = {}
 
     async def connect(self, websocket: WebSocket, sender_id: str) -> None:
         await websocket.accept()
-        self.active_connections[sender_id] = (websocket,)
+        self.active_connections.setdefault(sender_id, []).append(websocket)
+        self._by_socket[id(websocket)] = sender_id
 
-    def disconnect(self, websocket: WebSocket, sender_id: str) -> None:
-        if sender_id not in self.active_connections:
+    def disconnect(self, websocket: WebSocket) -> None:
+        sender_id = self._by_socket.pop(id(websocket), None)
+        if sender_id is None:
             return
-        del self.active_connections[sender_id]
+        sockets = self.active_connections[sender_id]
+        sockets.remove(websocket)
+        if not sockets:
+            del self.active_connections[sender_id]
 
     async def send_message(
-        self, message: CreateMessage | UpdateMessage, websocket: WebSocket
+        self,
+        message: CreateMessage | UpdateMessage,
+        websocket: WebSocket,
+        receiver_ids: Iterable[str] = (),
     ) -> None:
-        if isinstance(message, CreateMessage):
-            text = message.text or message.photo
-        elif isinstance(message, UpdateMessage):
-            text = message.text
-        await websocket.send_text(text)  # pyright: ignore[reportArgumentType]
+        # extracted once and fanned out to every socket of the sender and
+        # the receivers; a set so a self-addressed message is sent once
+        text = _payload_extractors[type(message)](message)
+        user_ids = set(receiver_ids)
+        sender_id = self._by_socket.get(id(websocket))
+        if sender_id is not None:
+            user_ids.add(sender_id)
+        await self.broadcast(text, user_ids)
+
+    async def broadcast(self, message: str, user_ids: Iterable[str]) -> None:
+        sockets = [
+            websocket
+            for user_id in user_ids
+            for websocket in self.active_connections.get(user_id, ())
+        ]
+        results = await asyncio.gather(
+            *(websocket.send_text(message) for websocket in sockets),
+            return_exceptions=True,
+        )
+        # a failed send means the peer is gone, stop tracking that socket
+        for websocket, result in zip(sockets, results):
+            if isinstance(result, Exception):
+                self.disconnect(websocket)
 
     def is_connected(self, user_id: str) -> bool:
-        return bool(self.active_connections.get(user_id, False))
+        return user_id in self.active_connections
 
 
-manager = WsConnectionManager()
+manager: WsConnectionManager = WsConnectionManager()
@@ -1,14 +1,16 @@
 import datetime
 
-from sqlalchemy import DateTime
+from sqlalchemy import DateTime, func
 from sqlalchemy.orm import Mapped, declarative_mixin, mapped_column
 
 
 @declarative_mixin
 class TimestampMixin:
+    # clock_timestamp() rather than now(): rows inserted by one statement
+    # still get distinct, ordered values
     creation_date: Mapped[datetime.datetime] = mapped_column(
-        DateTime, default=datetime.datetime.now
+        DateTime, server_default=func.clock_timestamp()
     )
     modified_date: Mapped[datetime.datetime] = mapped_column(
-        DateTime, nullable=True
+        DateTime, nullable=True, onupdate=func.clock_timestamp()
     )
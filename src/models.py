@@ -1,4 +1,12 @@
-from sqlalchemy import CheckConstraint, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy import (
+    CheckConstraint,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+)
 from sqlalchemy.orm import Mapped, mapped_column
 
 from src.enums import UserRole
@@ -24,7 +32,7 @@ class User(Base, TimestampMixin):
     is_superuser: Mapped[bool] = mapped_column(default=False)
 
     def is_connected_ws(self):
-        return bool(manager.active_connections.get(str(self.id), False))
+        return manager.is_connected(str(self.id))
 
 
 class Personal(Base, TimestampMixin):
@@ -48,7 +56,7 @@ class Message(Base, TimestampMixin):
 
     sender: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
 
-    chat_id: Mapped[int] = mapped_column(ForeignKey("chat.id"), index=True)
+    chat_id: Mapped[int] = mapped_column(ForeignKey("chat.id"))
 
     receiver: Mapped[int] = mapped_column(
         ForeignKey("user.id"), nullable=False
@@ -57,6 +65,14 @@ class Message(Base, TimestampMixin):
     __table_args__ = (CheckConstraint("NOT(photo IS NULL AND text IS NULL)"),)
 
 
+Index(
+    "ix_message_chat_id_creation_date_id",
+    Message.chat_id,
+    Message.creation_date.desc(),
+    Message.id.desc(),
+)
+
+
 class Chat(Base, TimestampMixin):
     __tablename__ = "chat"
 
@@ -1,21 +1,24 @@
-from typing import Annotated
+import datetime
+from typing import Annotated, AsyncIterator
 
+import orjson
 from fastapi import (
     APIRouter,
     BackgroundTasks,
     Depends,
     HTTPException,
-    Request,
+    Query,
     status,
 )
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth import (
+    AuthUser,
     RefreshToken,
-    Token,
-    _get_token_from_request,
     check_authenticate,
     check_credentials,
+    get_authenticated_user,
     get_user_from_request,
 )
 from src.crud import (
@@ -25,8 +28,9 @@ from src.crud import (
     delete_chat,
     get_chats_by_user,
     get_messages_model,
-    get_personal_model,
-    get_user_model,
+    get_user_cached,
+    get_user_with_personal_by_id,
+    iter_messages_model,
     update_profile_model,
     update_user_model,
 )
@@ -39,15 +43,16 @@ from src.schemas import (
     ChangePassword,
     Credentials,
     MailSchema,
+    Me,
+    ProfilePrivate,
+    ProfilePublic,
     RefreshTokenSchema,
     Register,
     UpdateProfile,
+    UserSchema,
     UserView,
 )
-from src.utils import (
-    get_password_hash,
-    remove_private_data,
-)
+from src.storage import async_session_maker
 
 router = APIRouter(prefix="/user")
 
@@ -57,14 +62,9 @@ async def registration_user(
     db: Annotated[AsyncSession, Depends(get_async_session)], body: Register
 ):
     user = await create_user_model(db, body)
-    personal = await create_personal_model(db, body, user["id"])
+    personal = await create_personal_model(db, body, user.id)
     await db.commit()
-    schema = {**user, **personal}
-    if "modified_date" not in schema:
-        schema["modified_date"] = None
-    if "password" in schema:
-        del schema["password"]
-    return UserView(**schema)
+    return UserView.from_models(user, personal)
 
 
 @router.post("/login", status_code=status.HTTP_201_CREATED)
@@ -82,85 +82,62 @@ async def refresh_token(token: RefreshTokenSchema):
 
 @router.put("/change/password/{user_id}", status_code=status.HTTP_200_OK)
 async def change_password(
-    request: Request,
+    auth_user: Annotated[AuthUser, Depends(get_authenticated_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
     credentials: ChangePassword,
     background_tasks: BackgroundTasks,
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
-    user_id = user_data.user_id()
-    user_email = user_data.user_email()
-    user = await check_credentials(db, credentials)
-    if user_id != user.id:
+    user, personal = await check_credentials(db, credentials, for_update=True)
+    if auth_user.id != user.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Provided credentials not correct",
         )
-    new_password_to_mail = credentials.new_password
-    credentials.new_password = get_password_hash(credentials.new_password)
-    changed_user_credentials = await update_user_model(
-        db, credentials, user_id=user_id
+    changed_user = await update_user_model(db, credentials, user_id=user.id)
+    msg = f"Your password was changed {credentials.new_password}"
+    mail = MailSchema(
+        recipients=[personal.email],
+        body=msg,
+        subject="Ouath2: Changed password",
     )
-    if "password" in changed_user_credentials:
-        msg = f"Your password was changed {new_password_to_mail}"
-        mail = MailSchema(
-            recipients=[user_email],
-            body=msg,
-            subject="Ouath2: Changed password",
-        )
-        send_mail_background(background_tasks, mail)
-        del changed_user_credentials["password"]
-    return changed_user_credentials
+    send_mail_background(background_tasks, mail)
+    return UserSchema.model_validate(
+        changed_user, from_attributes=True
+    ).model_dump(exclude={"password"})
 
 
 @router.get("/profile/{user_id}", status_code=status.HTTP_200_OK)
 async def profile_user(
-    request: Request,
+    auth_user: Annotated[AuthUser, Depends(get_authenticated_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
     user_id: int,
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
-    user_id_from_token = user_data.user_id()
-    personal_model = await get_personal_model(db, user_id)
-    user_model = await get_user_model(db, user_id)
-    schema = {**user_model.__dict__, **personal_model}
-    if user_id != user_id_from_token:
-        remove_private_data(schema, to_another_user=True)
-    return schema
+    user_model, personal_model = await get_user_with_personal_by_id(
+        db, user_id
+    )
+    if user_id != auth_user.id:
+        return ProfilePublic.from_model(user_model)
+    return ProfilePrivate.from_models(user_model, personal_model)
 
 
 @router.put("/change/profile", status_code=status.HTTP_200_OK)
 async def change_profile(
-    request: Request,
+    auth_user: Annotated[AuthUser, Depends(get_authenticated_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
     profile: UpdateProfile,
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
-    user_id = user_data.user_id()
-    profile_model = await update_profile_model(db, profile, user_id)
-    user_model = await get_user_model(db, user_id)
-    schema = {**profile_model, **user_model.__dict__}
-    remove_private_data(schema)
-    return schema
+    profile_model = await update_profile_model(db, profile, auth_user.id)
+    user_model = await get_user_cached(db, auth_user.id)
+    return ProfilePrivate.from_models(user_model, profile_model)
 
 
 @router.post("/add-contact", status_code=status.HTTP_201_CREATED)
 async def add_contact(
-    request: Request,
+    auth_user: Annotated[AuthUser, Depends(get_authenticated_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
     payload: AddContact,
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
-    user_id = user_data.user_id()
-    if user_id != payload.id:
+    if auth_user.id != payload.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Permission Error"
         )
@@ -171,40 +148,57 @@ async def add_contact(
 
 @router.get("/contacts", status_code=status.HTTP_200_OK)
 async def list_contacts(
-    request: Request,
+    auth_user: Annotated[AuthUser, Depends(get_authenticated_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
-    owner = user_data.user_id()
-    return await get_chats_by_user(db, owner)
+    return await get_chats_by_user(db, auth_user.id)
 
 
-@router.delete("/contact/{chat_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete(
+    "/contact/{chat_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(get_authenticated_user)],
+)
 async def delete_contact(
-    request: Request,
     db: Annotated[AsyncSession, Depends(get_async_session)],
     chat_id: int,
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
     await delete_chat(db, chat_id)
 
 
-@router.get("/chat/{chat_id}", status_code=status.HTTP_200_OK)
+@router.get(
+    "/chat/{chat_id}",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(get_authenticated_user)],
+)
 async def get_chat(
-    request: Request,
     db: Annotated[AsyncSession, Depends(get_async_session)],
     chat_id: int,
+    limit: Annotated[int, Query(gt=0, le=200)] = 50,
+    before: datetime.datetime | None = None,
+    before_id: int | None = None,
 ):
-    token = _get_token_from_request(request)
-    user_data = Token(token, [UserRole.user, UserRole.administrator])
-    user_data.check_permission(exclude=False)
-    return await get_messages_model(db, chat_id)
+    return await get_messages_model(db, chat_id, limit, before, before_id)
+
+
+async def _export_lines(chat_id: int) -> AsyncIterator[bytes]:
+    # the request-scoped session is closed before a streamed body is sent
+    async with async_session_maker() as db:
+        async for message in iter_messages_model(db, chat_id):
+            yield orjson.dumps(message.to_dict()) + b"\n"
+
+
+@router.get(
+    "/chat/{chat_id}/export",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(get_authenticated_user)],
+)
+async def export_chat(chat_id: int) -> StreamingResponse:
+    return StreamingResponse(
+        _export_lines(chat_id), media_type="application/x-ndjson"
+    )
 
 
 @router.get("/me")
 async def me(user: Annotated[User, Depends(get_user_from_request)]):
-    return user
+    return Me.from_model(user)
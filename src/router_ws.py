@@ -1,4 +1,3 @@
-import json
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
@@ -33,6 +32,8 @@ html = """
         <h1>WebSocket Chat</h1>
         <form action="" onsubmit="sendMessage(event)">
             <label>Token: <input type="text" id="token" autocomplete="off" value="some-key-token"/></label>
+            <label>Sender id: <input type="number" id="senderId"/></label>
+            <label>Receiver id: <input type="number" id="receiverId"/></label>
             <button onclick="connect(event)">Connect</button>
             <hr>
             <label>Message: <input type="text" id="messageText" autocomplete="off"/></label>
@@ -44,7 +45,8 @@ html = """
         var ws = null;
             function connect(event) {
                 var token = document.getElementById("token")
-                ws = new WebSocket("ws://localhost:8000/oauth2/api/v1/ws?token=" + token.value);
+                var receiver = document.getElementById("receiverId")
+                ws = new WebSocket("ws://localhost:8000/oauth2/api/v1/ws/" + receiver.value + "?token=" + token.value);
                 ws.onmessage = function(event) {
                     var messages = document.getElementById('messages')
                     var message = document.createElement('li')
@@ -56,7 +58,15 @@ html = """
             }
             function sendMessage(event) {
                 var input = document.getElementById("messageText")
-                ws.send(input.value)
+                ws.send(JSON.stringify({
+                    message: {
+                        kind: "create",
+                        text: input.value,
+                        photo: null,
+                        sender_id: Number(document.getElementById("senderId").value),
+                        receiver_id: Number(document.getElementById("receiverId").value),
+                    }
+                }))
                 input.value = ''
                 event.preventDefault()
             }
@@ -80,21 +90,27 @@ async def websocket_endpoint(
     receiver: int,
 ):
     user_id = str(user.id)
-    if not manager.is_connected(user_id):
-        await manager.connect(websocket, user_id)
+    receiver_ids = (str(receiver),)
+    await manager.connect(websocket, user_id)
     try:
         while True:
             data = await websocket.receive_text()
-            validated_data = json.loads(data)
-            message = WSMessageRequest.model_validate(validated_data)
-            message.message.receiver_id = receiver
+            message = WSMessageRequest.model_validate_json(data)
             if isinstance(message.message, CreateMessage):
+                message.message.receiver_id = receiver
                 await create_message_model(db, message.message)
-                await manager.send_message(message.message, websocket)
+                await manager.send_message(
+                    message.message, websocket, receiver_ids
+                )
             elif isinstance(message.message, DeleteMessage):
                 await delete_message_model(db, message.message)
             elif isinstance(message.message, UpdateMessage):
                 await update_message_model(db, message.message)
-                await manager.send_message(message.message, websocket)
+                await manager.send_message(
+                    message.message, websocket, receiver_ids
+                )
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
+        pass
+    finally:
+        # also on invalid frames or db errors, which end the handler too
+        manager.disconnect(websocket)
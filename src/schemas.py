@@ -1,6 +1,7 @@
 import datetime
 import re
-from typing import Annotated
+from functools import lru_cache
+from typing import TYPE_CHECKING, Annotated, Literal
 
 from email_validator import EmailNotValidError, validate_email
 from fastapi import HTTPException, status
@@ -13,6 +14,17 @@ from pydantic import (
 
 from src.enums import UserRole
 
+if TYPE_CHECKING:
+    from src.models import Personal, User
+
+_phone_pattern = re.compile(r"^(\+)[1-9][0-9\-\(\)\.]{9,15}$")
+
+
+# pure function of its input; invalid addresses raise and are not cached
+@lru_cache(maxsize=8192)
+def _normalize_email(email: str) -> str:
+    return validate_email(email, check_deliverability=False).normalized
+
 
 class UserView(BaseModel):
     id: int
@@ -24,9 +36,77 @@ class UserView(BaseModel):
     phone: str
     email: str
 
+    @classmethod
+    def from_models(cls, user: "User", personal: "Personal") -> "UserView":
+        # rows come straight from the database, so validation is skipped
+        return cls.model_construct(
+            id=user.id,
+            username=user.username,
+            creation_date=user.creation_date,
+            modified_date=user.modified_date,
+            is_active=user.is_active,
+            is_superuser=user.is_superuser,
+            phone=personal.phone,
+            email=personal.email,
+        )
+
+
+class ProfilePublic(BaseModel):
+    id: int
+    username: str
+    creation_date: datetime.datetime
+    modified_date: datetime.datetime | None
+
+    @classmethod
+    def from_model(cls, user: "User") -> "ProfilePublic":
+        return cls.model_construct(
+            id=user.id,
+            username=user.username,
+            creation_date=user.creation_date,
+            modified_date=user.modified_date,
+        )
+
+
+class ProfilePrivate(ProfilePublic):
+    role: UserRole
+    is_active: bool
+    is_superuser: bool
+    phone: str
+    email: str
+
+    @classmethod
+    def from_models(
+        cls, user: "User", personal: "Personal"
+    ) -> "ProfilePrivate":
+        return cls.model_construct(
+            id=user.id,
+            username=user.username,
+            creation_date=user.creation_date,
+            modified_date=user.modified_date,
+            role=user.role,
+            is_active=user.is_active,
+            is_superuser=user.is_superuser,
+            phone=personal.phone,
+            email=personal.email,
+        )
 
-class Me(BaseModel):
-    pass
+
+class Me(ProfilePublic):
+    role: UserRole
+    is_active: bool
+    is_superuser: bool
+
+    @classmethod
+    def from_model(cls, user: "User") -> "Me":
+        return cls.model_construct(
+            id=user.id,
+            username=user.username,
+            creation_date=user.creation_date,
+            modified_date=user.modified_date,
+            role=user.role,
+            is_active=user.is_active,
+            is_superuser=user.is_superuser,
+        )
 
 
 class Credentials(BaseModel):
@@ -39,7 +119,8 @@ class UserSchema(BaseModel):
     username: str
     password: str
     role: UserRole
-    created_at: datetime.datetime
+    creation_date: datetime.datetime
+    modified_date: datetime.datetime | None
     is_active: bool
     is_superuser: bool
 
@@ -69,8 +150,7 @@ class UpdateProfile(BaseModel):
         if email is None:
             return email
         try:
-            emailinfo = validate_email(email, check_deliverability=False)
-            return emailinfo.normalized
+            return _normalize_email(email)
         except EmailNotValidError as e:
             raise ValueError(
                 f"Unexpected value {e!r}, expected format is 'mail@.x'"
@@ -81,13 +161,18 @@ class UpdateProfile(BaseModel):
     def valid_phone(cls, phone: str | None) -> str | None:
         if phone is None:
             return phone
-        pattern = r"^(\+)[1-9][0-9\-\(\)\.]{9,15}$"
-        if re.match(pattern, phone):
+        if _phone_pattern.match(phone):
             return phone
         raise ValueError(
             f"Unexpected value {phone!r}, expected format is +79005001010"
         )
 
+    @model_validator(mode="after")
+    def check_any_field_set(self):
+        if self.phone is None and self.email is None:
+            raise ValueError("required any of phone or email")
+        return self
+
 
 class Register(UpdateProfile):
     username: str
@@ -124,19 +209,23 @@ class IdField(BaseModel):
 
 
 class DeleteMessage(IdField):
-    pass
+    kind: Literal["delete"] = "delete"
 
 
-class UpdateMessage(DeleteMessage):
+class UpdateMessage(IdField):
+    kind: Literal["update"] = "update"
     text: str
 
 
 class CreateMessage(BaseMessage):
-    pass
+    kind: Literal["create"] = "create"
 
 
 class WSMessageRequest(BaseModel):
-    message: UpdateMessage | CreateMessage | DeleteMessage
+    message: Annotated[
+        CreateMessage | UpdateMessage | DeleteMessage,
+        Field(discriminator="kind"),
+    ]
 
     class Config:
         from_attributes = True
@@ -1,20 +1,66 @@
+import itertools
+import logging
+from typing import Any, Collection
+
 from motor.motor_asyncio import AsyncIOMotorClient
 from redis import asyncio as aioredis
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import NullPool
 
 from src.config import settings
 
 
 class Base(DeclarativeBase):
-    pass
+    def to_dict(self, exclude: Collection[str] = ()) -> dict[str, Any]:
+        return {
+            attr.key: getattr(self, attr.key)
+            for attr in self.__mapper__.column_attrs
+            if attr.key not in exclude
+        }
+
+
+if settings.PG_NULL_POOL:
+    pool_options: dict[str, Any] = {"poolclass": NullPool}
+else:
+    pool_options = {
+        "pool_size": settings.PG_POOL_SIZE,
+        "max_overflow": settings.PG_MAX_OVERFLOW,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "pool_use_lifo": True,
+    }
+
+engine = create_async_engine(
+    settings.db_url_postgresql,
+    echo=settings.DB_ECHO,
+    # per-connection LRU of server-side prepared statements kept by
+    # SQLAlchemy's asyncpg adapter (default 100)
+    connect_args={
+        "prepared_statement_cache_size": settings.PG_STATEMENT_CACHE_SIZE
+    },
+    **pool_options,
+)
+
+if settings.DB_LOG_SAMPLE_RATE > 0:
+    # log only every n-th statement, without parameters, as a cheap
+    # alternative to echo on a loaded instance
+    _sql_logger = logging.getLogger("src.storage.sql")
+    _statement_counter = itertools.count()
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _log_sampled_statement(
+        conn: Any, cursor: Any, statement: str, *args: Any
+    ) -> None:
+        if next(_statement_counter) % settings.DB_LOG_SAMPLE_RATE == 0:
+            _sql_logger.info(statement)
 
 
-engine = create_async_engine(settings.db_url_postgresql, echo=True)
 async_session_maker = async_sessionmaker(
     engine,
     class_=AsyncSession,
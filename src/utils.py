@@ -1,27 +1,87 @@
+import asyncio
+import hashlib
+import hmac
 import re
 import secrets
-from typing import NoReturn
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NoReturn
 
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache
 from fastapi import (
     HTTPException,
     status,
 )
-from passlib.context import CryptContext
-from sqlalchemy.exc import SQLAlchemyError
+from passlib.handlers.bcrypt import bcrypt
+from sqlalchemy.exc import IntegrityError, NoResultFound, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Argon2id with the OWASP baseline profile (19 MiB, t=2, p=1)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+_argon2_prefix = "$argon2"
+
+# successful verifications only, keyed by an HMAC of the password and its
+# stored hash under a per-process key: repeat logins skip the slow hash,
+# wrong guesses still pay for it, and a changed hash never matches. The
+# cost is that a correct password stays cheap to confirm for the ttl.
+_verified_key = secrets.token_bytes(32)
+_verified: TTLCache[bytes, bool] = TTLCache(maxsize=10_000, ttl=60)  # pyright: ignore[reportAssignmentType]
 
 
 def generate_random_credential(length: int) -> str:
     return secrets.token_hex(length // 2)
 
 
-def verify_password(plain_password: str, hashed_password: bytes | str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def _verify_password(
+    plain_password: str, hashed_password: bytes | str
+) -> bool:
+    if isinstance(hashed_password, bytes):
+        hashed_password = hashed_password.decode()
+    if not hashed_password.startswith(_argon2_prefix):
+        # bcrypt is kept only to verify hashes created before the switch
+        # to argon2, which are rehashed on next login
+        try:
+            return bcrypt.verify(plain_password, hashed_password)
+        except ValueError:
+            return False
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+# both hashers are CPU-bound and release the GIL, so run them in threads
+# to keep the event loop free during login and registration bursts
+async def verify_password(
+    plain_password: str, hashed_password: bytes | str
+) -> bool:
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode()
+    key = hmac.digest(
+        _verified_key,
+        hashed_password + b"\0" + plain_password.encode(),
+        hashlib.sha256,
+    )
+    if key in _verified:
+        return True
+    verified = await asyncio.to_thread(
+        _verify_password, plain_password, hashed_password
+    )
+    if verified:
+        _verified[key] = True
+    return verified
+
 
+async def get_password_hash(password: str) -> str:
+    return await asyncio.to_thread(password_hasher.hash, password)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    if not hashed_password.startswith(_argon2_prefix):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
 
 
 def handle_error(error: SQLAlchemyError) -> NoReturn:
@@ -32,6 +92,26 @@ def handle_error(error: SQLAlchemyError) -> NoReturn:
     )
 
 
+@asynccontextmanager
+async def db_guard(
+    db: AsyncSession, *, rollback: bool = True
+) -> AsyncIterator[None]:
+    try:
+        yield
+    except (
+        NoResultFound,
+        SQLAlchemyError,
+        IntegrityError,
+    ) as e:
+        if not rollback:
+            handle_error(e)
+        # a failed rollback must not mask the original error
+        try:
+            await db.rollback()
+        finally:
+            handle_error(e)
+
+
 def convert_sqlachemy_exception(error: SQLAlchemyError):
     if "DETAIL" in repr(error):
         detail = repr(error).partition("DETAIL")[-1]
@@ -42,17 +122,3 @@ def convert_sqlachemy_exception(error: SQLAlchemyError):
     pattern = r"[^a-zA-Zа-яА-Я@\s+=.]"
     cleaned_string = re.sub(pattern, "", detail)
     return cleaned_string.strip()
-
-
-def remove_private_data(
-    payload: dict, *, to_another_user: bool = False
-) -> None:
-    if to_another_user:
-        del payload["phone"]
-        del payload["email"]
-        del payload["role"]
-        del payload["is_active"]
-        del payload["is_superuser"]
-        del payload["password"]
-    else:
-        del payload["password"]
@@ -0,0 +1,76 @@
+import hashlib
+import time
+from typing import Any
+
+import pytest
+from fastapi import HTTPException
+
+from src import auth
+from src.auth import Token, create_token_pair
+from src.enums import UserRole
+
+
+@pytest.fixture()
+def decode_calls(monkeypatch: Any) -> list[str]:
+    # records every token that reaches signature verification
+    calls: list[str] = []
+    decode = auth._jwt.decode
+
+    def counting_decode(token: str, **kwargs: Any) -> dict[str, Any]:
+        calls.append(token)
+        return decode(token, **kwargs)
+
+    monkeypatch.setattr(auth._jwt, "decode", counting_decode)
+    auth._jwt_cache.clear()
+    return calls
+
+
+def access_token() -> str:
+    return create_token_pair(user_id="1", user_role=UserRole.user)["access"]
+
+
+def cache_key(token: str) -> tuple[bytes, bytes]:
+    return (hashlib.sha256(token.encode()).digest(), auth._secret_key)
+
+
+def test_decoded_token_is_cached(decode_calls: list[str]) -> None:
+    token = access_token()
+
+    assert Token(token, UserRole.user).user_id() == 1
+    assert Token(token, UserRole.user).user_id() == 1
+    assert decode_calls == [token]
+
+
+def test_expired_cache_entry_is_ignored(decode_calls: list[str]) -> None:
+    token = access_token()
+    Token(token, UserRole.user).user_id()
+    payload = auth._jwt_cache[cache_key(token)]
+    payload["exp"] = str(int(time.time()) - 1)
+
+    Token(token, UserRole.user).user_id()
+
+    assert decode_calls == [token, token]
+    assert int(auth._jwt_cache[cache_key(token)]["exp"]) > time.time()
+
+
+def test_invalid_token_is_never_cached(decode_calls: list[str]) -> None:
+    token = access_token()[:-2] + "xx"
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as error:
+            Token(token, UserRole.user).user_id()
+        assert error.value.status_code == 401
+
+    assert decode_calls == [token, token]
+    assert len(auth._jwt_cache) == 0
+
+
+def test_user_email_or_none() -> None:
+    with_email = create_token_pair(
+        user_id="1", user_role=UserRole.user, user_email="a@example.com"
+    )["access"]
+
+    assert Token(with_email, UserRole.user).user_email_or_none() == (
+        "a@example.com"
+    )
+    assert Token(access_token(), UserRole.user).user_email_or_none() is None
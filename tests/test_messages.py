@@ -0,0 +1,89 @@
+import asyncio
+from typing import Any
+
+import orjson
+from fastapi.testclient import TestClient
+
+from src import router
+from src.auth import AuthUser, get_authenticated_user
+from src.crud import iter_messages_model
+from src.main import app
+from src.models import Message
+
+
+class FakeStream:
+    def __init__(self, rows: list[Message]) -> None:
+        self.rows = rows
+        self.closed = False
+
+    def __aiter__(self) -> "FakeStream":
+        self.iterator = iter(self.rows)
+        return self
+
+    async def __anext__(self) -> Message:
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, stream: FakeStream) -> None:
+        self.stream = stream
+        self.params: dict[str, Any] = {}
+
+    async def stream_scalars(self, _: Any, params: dict[str, Any]) -> Any:
+        self.params = params
+        return self.stream
+
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *_: object) -> None:
+        return None
+
+
+def make_messages(count: int) -> list[Message]:
+    return [
+        Message(id=i, text=f"text {i}", sender=1, receiver=2, chat_id=7)
+        for i in range(count)
+    ]
+
+
+def test_iter_messages_closes_stream_on_early_exit() -> None:
+    stream = FakeStream(make_messages(3))
+
+    async def consume_one() -> Message:
+        messages = iter_messages_model(FakeSession(stream), 7)  # type: ignore[arg-type]
+        try:
+            return await anext(messages)
+        finally:
+            await messages.aclose()
+
+    message = asyncio.run(consume_one())
+
+    assert message.id == 0
+    assert stream.closed
+
+
+def test_export_chat_streams_ndjson(monkeypatch: Any) -> None:
+    stream = FakeStream(make_messages(2))
+    session = FakeSession(stream)
+    monkeypatch.setattr(router, "async_session_maker", lambda: session)
+    app.dependency_overrides[get_authenticated_user] = lambda: AuthUser(
+        id=1, role="user", email=None
+    )
+    try:
+        response = TestClient(app).get("/oauth2/api/v1/user/chat/7/export")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [0, 1]
+    assert session.params == {"chat_id": 7}
+    assert stream.closed
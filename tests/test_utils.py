@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any
+
+import pytest
+from passlib.handlers.bcrypt import bcrypt
+
+from src import utils
+from src.utils import get_password_hash, verify_password
+
+
+@pytest.fixture()
+def verify_calls(monkeypatch: Any) -> list[str]:
+    # records every verification that reaches the slow hasher
+    calls: list[str] = []
+    verify = utils._verify_password
+
+    def counting_verify(plain: str, hashed: bytes | str) -> bool:
+        calls.append(plain)
+        return verify(plain, hashed)
+
+    monkeypatch.setattr(utils, "_verify_password", counting_verify)
+    utils._verified.clear()
+    return calls
+
+
+def test_verify_password_accepts_legacy_bcrypt_hash() -> None:
+    hashed = bcrypt.hash("secret")
+
+    assert asyncio.run(verify_password("secret", hashed))
+    assert not asyncio.run(verify_password("wrong", hashed))
+
+
+def test_verify_password_rejects_malformed_hash() -> None:
+    assert not asyncio.run(verify_password("secret", "not-a-hash"))
+    assert not asyncio.run(verify_password("secret", "$argon2id$broken"))
+
+
+def test_successful_verification_is_cached(verify_calls: list[str]) -> None:
+    hashed = asyncio.run(get_password_hash("secret"))
+
+    assert asyncio.run(verify_password("secret", hashed))
+    assert asyncio.run(verify_password("secret", hashed))
+    assert verify_calls == ["secret"]
+
+
+def test_failed_verification_is_never_cached(verify_calls: list[str]) -> None:
+    hashed = asyncio.run(get_password_hash("secret"))
+
+    assert not asyncio.run(verify_password("wrong", hashed))
+    assert not asyncio.run(verify_password("wrong", hashed))
+    assert verify_calls == ["wrong", "wrong"]
+    assert len(utils._verified) == 0
+
+
+def test_new_stored_hash_misses_old_entry(verify_calls: list[str]) -> None:
+    old_hash = asyncio.run(get_password_hash("secret"))
+    new_hash = asyncio.run(get_password_hash("secret"))
+
+    assert asyncio.run(verify_password("secret", old_hash))
+    assert asyncio.run(verify_password("secret", new_hash))
+    assert verify_calls == ["secret", "secret"]